@@ -2,16 +2,11 @@
 Main script to run the entire data collection pipeline
 Главный скрипт для запуска всего пайплайна сбора данных
 """
-import sys
 import os
 from pathlib import Path
 
-# Добавление директории scripts в путь
-scripts_dir = Path(__file__).parent / 'scripts'
-sys.path.insert(0, str(scripts_dir))
-
-import yaml
-from logger_config import setup_logger
+from scripts.config_cache import get_config
+from scripts.logger_config import setup_logger
 
 
 def main():
@@ -28,8 +23,7 @@ def main():
         logger.error(f"Файл конфигурации {config_path} не найден!")
         return
     
-    with open(config_path, 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
+    config = get_config(config_path)
     
     # Проверка API ключей
     api_keys = config.get('api_keys', {})
@@ -52,11 +46,11 @@ def main():
     logger.info("5. Объединение всех данных")
     logger.info("\nДля запуска отдельных этапов используйте соответствующие скрипты в папке scripts/")
     logger.info("\nПримеры:")
-    logger.info("  python scripts/scrape_crexi.py")
-    logger.info("  python scripts/scrape_loopnet.py")
-    logger.info("  python scripts/api_census.py")
-    logger.info("  python scripts/api_google_maps.py")
-    logger.info("  python scripts/combine_data.py")
+    logger.info("  python -m scripts.scrape_crexi")
+    logger.info("  python -m scripts.scrape_loopnet")
+    logger.info("  python -m scripts.api_census")
+    logger.info("  python -m scripts.api_google_maps")
+    logger.info("  python -m scripts.combine_data")
     
     logger.info("\n" + "=" * 60)
     logger.info("Пайплайн готов к использованию!")
@@ -1,2 +1,3 @@
 # Scripts package
-
+# Подмодули не импортируются здесь намеренно: main.py импортирует только
+# config_cache и logger_config, и запуск не должен тянуть pandas/requests.
@@ -2,18 +2,86 @@
 API script for collecting demographic data from US Census Bureau
 Выполняет минимум 5 различных запросов к API
 """
-import yaml
+import numpy as np
+import orjson
+import os
+import pickle
+import re
+import threading
 import pandas as pd
+from pandas.api.types import union_categoricals
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from typing import List, Dict, Any
-import sys
 from pathlib import Path
 
-# Добавление родительской директории в путь для импорта
-parent_dir = Path(__file__).parent.parent
-sys.path.insert(0, str(parent_dir))
-
+from scripts.config_cache import get_config
+from scripts.http_retry import retry_transient
 from scripts.logger_config import setup_logger
+from scripts.utils import ABBR_TO_FIPS, FIPS_TO_STATE
+
+# Тип населенного пункта в конце названия места Census ("New York city", "Aloha CDP")
+PLACE_SUFFIX_RE = re.compile(
+    r'\s+(city and borough|city|town|village|borough|municipality|CDP|'
+    r'(?:metro|metropolitan|consolidated|unified) government|urban county)'
+    r'(\s+\(balance\))?$'
+)
+
+# Ключевые столбцы (FIPS-коды штата и места), по которым объединяются ответы
+KEY_COLUMNS = ['state', 'place']
+
+
+def _to_float(value) -> float:
+    """Преобразование значения Census в число (NaN для пустых и нечисловых значений)"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _downcast_counts(values: np.ndarray):
+    """
+    Сжатие столбца показателя Census до 32 бит
+    
+    Целые значения (численность, доход в долларах) хранятся как Int32 с поддержкой
+    пропусков, остальные - как float32.
+    """
+    finite = values[~np.isnan(values)]
+    if finite.size == 0 or (
+        np.array_equal(finite, np.round(finite))
+        and finite.min() >= np.iinfo(np.int32).min
+        and finite.max() <= np.iinfo(np.int32).max
+    ):
+        return pd.array(values, dtype='Int32')
+    return values.astype(np.float32)
+
+
+def _rate(numerator, denominator) -> np.ndarray:
+    """
+    Доля в процентах для столбца или блока столбцов (float32)
+    
+    Args:
+        numerator: Series или DataFrame с числителями
+        denominator: Series со знаменателем
+        
+    Returns:
+        массив долей в процентах
+    """
+    num = numerator.to_numpy(dtype=np.float64, na_value=np.nan)
+    den = denominator.to_numpy(dtype=np.float64, na_value=np.nan)
+    if num.ndim == 2:
+        den = den[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (num / den * 100).astype(np.float32)
+
+
+def _normalize_place_name(name: str) -> str:
+    """Приведение названия города к виду для сопоставления ("New York city, New York" -> "new york")"""
+    name = str(name).split(',')[0].strip()
+    return PLACE_SUFFIX_RE.sub('', name).strip().lower()
 
 
 class CensusBureauAPI:
@@ -29,18 +97,69 @@ class CensusBureauAPI:
         if config_path is None:
             config_path = Path(__file__).parent.parent / 'config.yaml'
         
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = get_config(config_path)
         
         self.logger = setup_logger(config_path)
         self.api_key = self.config.get('api_keys', {}).get('census_bureau', '')
         self.api_config = self.config.get('api', {}).get('census_bureau', {})
         self.base_url = self.api_config.get('base_url', 'https://api.census.gov/data')
         self.timeout = self.api_config.get('timeout', 30)
+        self.cache_dir = 'data/cache'
+        
+        # Справочник мест по годам: нормализованное название -> [(state, place), ...]
+        self._place_index = {}
+        self._place_index_lock = threading.Lock()
+        
+        # Коды мест по списку городов и году: параллельные запросы collect_all_data определяют
+        # их один раз (и один раз предупреждают о неоднозначных и ненайденных городах)
+        self._resolved_places = {}
+        self._resolved_places_lock = threading.Lock()
+        
+        # Кэш HTTP-ответов на диске (ключ API не входит в ключ кэша)
+        self.session = requests_cache.CachedSession(
+            'data/cache/http',
+            backend='sqlite',
+            expire_after=timedelta(days=self.api_config.get('cache_expire_days', 7)),
+            allowable_methods=['GET'],
+            ignored_parameters=['key']
+        )
+        
+        # Пул соединений (повторы при временных ошибках выполняются в _do_get)
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
         if not self.api_key:
             self.logger.warning("API ключ Census Bureau не найден в конфигурации")
     
+    def close(self):
+        """Закрытие HTTP-сессии"""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    @retry_transient
+    def _do_get(self, url: str, params: dict) -> list:
+        """
+        GET-запрос к API с повтором при временных ошибках
+        
+        Args:
+            url: адрес запроса
+            params: параметры запроса
+            
+        Returns:
+            разобранный JSON-ответ
+        """
+        # CachedSession все равно читает тело целиком, чтобы сохранить его в кэш, поэтому
+        # потоковое чтение не экономит память; байты разбираются orjson без декодирования в str
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    
     def _make_request(self, endpoint: str, params: dict) -> dict:
         """
         Выполнение запроса к API
@@ -57,17 +176,174 @@ class CensusBureauAPI:
         
         try:
             self.logger.info(f"Запрос к API: {endpoint}")
-            response = requests.get(url, params=params, timeout=self.timeout)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._do_get(url, params)
             self.logger.info(f"Успешный ответ от API: {endpoint}")
             return data
             
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             self.logger.error(f"Ошибка при запросе к API {endpoint}: {e}")
             return {}
     
+    def _get_place_index(self, year: int) -> Dict[str, List[tuple]]:
+        """
+        Справочник FIPS-кодов мест за год (кэшируется в памяти и на диске)
+        
+        Args:
+            year: год данных
+            
+        Returns:
+            словарь: нормализованное название -> список пар (state, place)
+        """
+        with self._place_index_lock:
+            if year in self._place_index:
+                return self._place_index[year]
+            
+            cache_path = os.path.join(self.cache_dir, f'census_places_{year}.pkl')
+            if os.path.exists(cache_path):
+                with open(cache_path, 'rb') as f:
+                    index = pickle.load(f)
+            else:
+                data = self._make_request(f"{year}/acs/acs5", {
+                    'get': 'NAME',
+                    'for': 'place:*',
+                    'in': 'state:*'
+                })
+                if not data or len(data) < 2:
+                    return {}
+                
+                header = data[0]
+                name_i, state_i, place_i = header.index('NAME'), header.index('state'), header.index('place')
+                index = {}
+                for row in data[1:]:
+                    key = _normalize_place_name(row[name_i])
+                    index.setdefault(key, []).append((row[state_i], row[place_i]))
+                
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(cache_path, 'wb') as f:
+                    pickle.dump(index, f)
+            
+            self._place_index[year] = index
+            return index
+    
+    def _resolve_place_fips(self, cities: List[str], year: int) -> Dict[str, List[str]]:
+        """
+        Определение FIPS-кодов мест для списка городов
+        
+        Город можно уточнить штатом в виде "Город, ШТ" ("Houston, TX"); без штата
+        берутся все одноименные места страны. Результат кэшируется по списку городов и году.
+        
+        Args:
+            cities: список городов
+            year: год данных
+            
+        Returns:
+            словарь: код штата -> список кодов мест
+        """
+        key = (tuple(cities), year)
+        with self._resolved_places_lock:
+            if key in self._resolved_places:
+                return self._resolved_places[key]
+            
+            places_by_state = self._match_place_fips(cities, year)
+            # Без загруженного справочника результат не кэшируется: следующий вызов повторит загрузку
+            if year in self._place_index:
+                self._resolved_places[key] = places_by_state
+            return places_by_state
+    
+    def _match_place_fips(self, cities: List[str], year: int) -> Dict[str, List[str]]:
+        """
+        Поиск FIPS-кодов мест для списка городов по справочнику Census
+        
+        Args:
+            cities: список городов
+            year: год данных
+            
+        Returns:
+            словарь: код штата -> список кодов мест
+        """
+        index = self._get_place_index(year)
+        
+        places_by_state = {}
+        for city in cities:
+            matches = index.get(_normalize_place_name(city), [])
+            
+            name, _, state_abbr = str(city).rpartition(',')
+            state_abbr = state_abbr.strip().upper()
+            if name and state_abbr in ABBR_TO_FIPS:
+                state_fips = f"{ABBR_TO_FIPS[state_abbr]:02d}"
+                matches = [(state, place) for state, place in matches if state == state_fips]
+            elif len({state for state, _ in matches}) > 1:
+                states = ', '.join(sorted({FIPS_TO_STATE.get(state, state) for state, _ in matches}))
+                self.logger.warning(
+                    f"Город {city} найден в нескольких штатах ({states}): используются все; "
+                    f"для уточнения укажите штат в виде \"{city}, ШТ\""
+                )
+            
+            if not matches:
+                self.logger.warning(f"Город не найден в справочнике Census: {city}")
+            for state, place in matches:
+                places_by_state.setdefault(state, set()).add(place)
+        
+        return {state: sorted(places) for state, places in sorted(places_by_state.items())}
+    
+    def _request_places(self, endpoint: str, params: dict, cities: List[str], year: int) -> list:
+        """
+        Запрос данных только по заданным городам (по одному запросу на штат)
+        
+        Если список городов пуст, запрашиваются все места страны.
+        
+        Args:
+            endpoint: endpoint API
+            params: параметры запроса
+            cities: список городов
+            year: год данных
+            
+        Returns:
+            ответ API в виде списка строк (первая строка - заголовок)
+        """
+        if not cities:
+            return self._make_request(endpoint, params)
+        
+        places_by_state = self._resolve_place_fips(cities, year)
+        
+        data = []
+        for state, places in places_by_state.items():
+            state_params = dict(params, **{'for': f"place:{','.join(places)}", 'in': f"state:{state}"})
+            part = self._make_request(endpoint, state_params)
+            if part and len(part) > 1:
+                if not data:
+                    data.append(part[0])
+                data.extend(part[1:])
+        
+        return data
+    
+    def _to_dataframe(self, data: list, numeric_cols: List[str]) -> pd.DataFrame:
+        """
+        Построение DataFrame из ответа API по столбцам
+        
+        Args:
+            data: ответ API (первая строка - заголовок)
+            numeric_cols: столбцы, преобразуемые в числа
+            
+        Returns:
+            DataFrame с 32-битными числовыми столбцами и категориальными ключами
+        """
+        header, rows = data[0], data[1:]
+        n = len(rows)
+        columns = dict(zip(header, zip(*rows)))
+        
+        frame = {}
+        for name in header:
+            if name in numeric_cols:
+                values = np.fromiter((_to_float(v) for v in columns[name]), dtype=np.float64, count=n)
+                frame[name] = _downcast_counts(values)
+            elif name in KEY_COLUMNS:
+                frame[name] = pd.Categorical(columns[name])
+            else:
+                frame[name] = np.array(columns[name], dtype=object)
+        
+        return pd.DataFrame(frame)
+    
     def get_population_by_city(self, cities: List[str], year: int = 2020) -> pd.DataFrame:
         """
         Запрос 1: Получение данных о населении по городам
@@ -89,11 +365,10 @@ class CensusBureauAPI:
             'in': 'state:*'
         }
         
-        data = self._make_request(endpoint, params)
+        data = self._request_places(endpoint, params, cities, year)
         
         if data and len(data) > 1:
-            df = pd.DataFrame(data[1:], columns=data[0])
-            df['B01001_001E'] = pd.to_numeric(df['B01001_001E'], errors='coerce')
+            df = self._to_dataframe(data, ['B01001_001E'])
             df = df.rename(columns={'B01001_001E': 'population'})
             return df
         else:
@@ -120,11 +395,10 @@ class CensusBureauAPI:
             'in': 'state:*'
         }
         
-        data = self._make_request(endpoint, params)
+        data = self._request_places(endpoint, params, cities, year)
         
         if data and len(data) > 1:
-            df = pd.DataFrame(data[1:], columns=data[0])
-            df['B19013_001E'] = pd.to_numeric(df['B19013_001E'], errors='coerce')
+            df = self._to_dataframe(data, ['B19013_001E'])
             df = df.rename(columns={'B19013_001E': 'median_household_income'})
             return df
         else:
@@ -151,12 +425,10 @@ class CensusBureauAPI:
             'in': 'state:*'
         }
         
-        data = self._make_request(endpoint, params)
+        data = self._request_places(endpoint, params, cities, year)
         
         if data and len(data) > 1:
-            df = pd.DataFrame(data[1:], columns=data[0])
-            for col in ['B23025_002E', 'B23025_003E', 'B23025_004E', 'B23025_005E']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+            df = self._to_dataframe(data, ['B23025_002E', 'B23025_003E', 'B23025_004E', 'B23025_005E'])
             df = df.rename(columns={
                 'B23025_002E': 'in_labor_force',
                 'B23025_003E': 'civilian_labor_force',
@@ -164,7 +436,7 @@ class CensusBureauAPI:
                 'B23025_005E': 'unemployed'
             })
             if 'employed' in df.columns and 'in_labor_force' in df.columns:
-                df['employment_rate'] = df['employed'] / df['in_labor_force'] * 100
+                df['employment_rate'] = _rate(df['employed'], df['in_labor_force'])
             return df
         else:
             self.logger.warning("Не удалось получить данные о занятости")
@@ -190,12 +462,10 @@ class CensusBureauAPI:
             'in': 'state:*'
         }
         
-        data = self._make_request(endpoint, params)
+        data = self._request_places(endpoint, params, cities, year)
         
         if data and len(data) > 1:
-            df = pd.DataFrame(data[1:], columns=data[0])
-            for col in ['B25001_001E', 'B25002_001E', 'B25002_002E', 'B25002_003E']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+            df = self._to_dataframe(data, ['B25001_001E', 'B25002_001E', 'B25002_002E', 'B25002_003E'])
             df = df.rename(columns={
                 'B25001_001E': 'total_housing_units',
                 'B25002_001E': 'total_occupied',
@@ -203,7 +473,7 @@ class CensusBureauAPI:
                 'B25002_003E': 'vacant'
             })
             if 'total_housing_units' in df.columns and 'vacant' in df.columns:
-                df['vacancy_rate'] = df['vacant'] / df['total_housing_units'] * 100
+                df['vacancy_rate'] = _rate(df['vacant'], df['total_housing_units'])
             return df
         else:
             self.logger.warning("Не удалось получить данные о жилье")
@@ -229,13 +499,10 @@ class CensusBureauAPI:
             'in': 'state:*'
         }
         
-        data = self._make_request(endpoint, params)
+        data = self._request_places(endpoint, params, cities, year)
         
         if data and len(data) > 1:
-            df = pd.DataFrame(data[1:], columns=data[0])
-            for col in df.columns:
-                if col not in ['state', 'place']:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
+            df = self._to_dataframe(data, [col for col in data[0] if col not in ['state', 'place']])
             df = df.rename(columns={
                 'B15003_001E': 'total_population_25plus',
                 'B15003_022E': 'bachelors_degree',
@@ -244,9 +511,13 @@ class CensusBureauAPI:
                 'B15003_025E': 'doctorate_degree'
             })
             if 'total_population_25plus' in df.columns:
-                for col in ['bachelors_degree', 'masters_degree', 'professional_degree', 'doctorate_degree']:
-                    if col in df.columns:
-                        df[f'{col}_rate'] = df[col] / df['total_population_25plus'] * 100
+                edu_cols = [
+                    col for col in ['bachelors_degree', 'masters_degree', 'professional_degree', 'doctorate_degree']
+                    if col in df.columns
+                ]
+                # Доли всех уровней образования одним векторным делением блока столбцов
+                rates = _rate(df[edu_cols], df['total_population_25plus'])
+                df[[f'{col}_rate' for col in edu_cols]] = rates
             return df
         else:
             self.logger.warning("Не удалось получить данные об образовании")
@@ -265,45 +536,42 @@ class CensusBureauAPI:
         """
         self.logger.info("Начало сбора всех данных через Census Bureau API")
         
-        # Выполнение всех 5+ запросов
-        dfs = []
-        
-        # Запрос 1: Население
-        df_pop = self.get_population_by_city(cities, year)
-        if not df_pop.empty:
-            dfs.append(('population', df_pop))
+        # Выполнение всех 5+ запросов параллельно (запросы независимы друг от друга)
+        requests_to_run = [
+            ('population', self.get_population_by_city),       # Запрос 1: Население
+            ('income', self.get_median_household_income),      # Запрос 2: Доходы
+            ('employment', self.get_employment_data),          # Запрос 3: Занятость
+            ('housing', self.get_housing_data),                # Запрос 4: Жилье
+            ('education', self.get_education_data),            # Запрос 5: Образование
+        ]
+        
+        with ThreadPoolExecutor(max_workers=len(requests_to_run)) as executor:
+            futures = [
+                (name, executor.submit(fn, cities, year))
+                for name, fn in requests_to_run
+            ]
         
-        # Запрос 2: Доходы
-        df_income = self.get_median_household_income(cities, year)
-        if not df_income.empty:
-            dfs.append(('income', df_income))
-        
-        # Запрос 3: Занятость
-        df_employment = self.get_employment_data(cities, year)
-        if not df_employment.empty:
-            dfs.append(('employment', df_employment))
-        
-        # Запрос 4: Жилье
-        df_housing = self.get_housing_data(cities, year)
-        if not df_housing.empty:
-            dfs.append(('housing', df_housing))
-        
-        # Запрос 5: Образование
-        df_education = self.get_education_data(cities, year)
-        if not df_education.empty:
-            dfs.append(('education', df_education))
+        dfs = []
+        for name, future in futures:
+            df = future.result()
+            if not df.empty:
+                dfs.append((name, df))
         
         # Объединение данных
         if dfs:
-            merged_df = dfs[0][1]
-            for name, df in dfs[1:]:
-                if 'state' in df.columns and 'place' in df.columns:
-                    merged_df = merged_df.merge(
-                        df,
-                        on=['state', 'place'],
-                        how='outer',
-                        suffixes=('', f'_{name}')
-                    )
+            # Общий набор категорий ключей, чтобы объединение шло по кодам категорий
+            for key in KEY_COLUMNS:
+                key_frames = [df for _, df in dfs if key in df.columns]
+                categories = union_categoricals([df[key] for df in key_frames]).categories
+                for df in key_frames:
+                    df[key] = df[key].cat.set_categories(categories)
+            
+            # Одно выровненное внешнее объединение по индексу (state, place) вместо попарных merge
+            merged_df = pd.concat(
+                [df.set_index(KEY_COLUMNS) for _, df in dfs],
+                axis=1,
+                join='outer'
+            ).reset_index()
             
             self.logger.info(f"Сбор данных завершен. Всего записей: {len(merged_df)}")
             return merged_df
@@ -317,15 +585,16 @@ def main():
     api = CensusBureauAPI()
     
     # Список городов для анализа
-    cities = ["New York", "Los Angeles", "Chicago", "Houston", "Phoenix"]
+    cities = ["New York, NY", "Los Angeles, CA", "Chicago, IL", "Houston, TX", "Phoenix, AZ"]
     
     # Сбор данных
-    df = api.collect_all_data(cities, year=2020)
+    with api:
+        df = api.collect_all_data(cities, year=2020)
     
     if not df.empty:
         # Сохранение данных
-        output_path = 'data/raw/census_data.csv'
-        df.to_csv(output_path, index=False, encoding='utf-8')
+        output_path = 'data/raw/census_data.parquet'
+        df.to_parquet(output_path, engine='pyarrow', compression='zstd', index=False)
         api.logger.info(f"Данные сохранены в {output_path}")
     else:
         api.logger.error("Не удалось собрать данные")
@@ -2,19 +2,50 @@
 API script for collecting transportation data from Google Maps API
 Собирает данные о транспорте и доступности локаций
 """
-import yaml
+import functools
+import numpy as np
 import pandas as pd
 import requests
-import time
-from typing import List, Dict, Any, Tuple
-import sys
+import requests_cache
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import List, Dict, Any, Tuple, Union
 from pathlib import Path
 
-# Добавление родительской директории в путь для импорта
-parent_dir = Path(__file__).parent.parent
-sys.path.insert(0, str(parent_dir))
-
+from scripts.config_cache import get_config
+from scripts.http_retry import retry_transient
 from scripts.logger_config import setup_logger
+from scripts.rate_limiter import RateLimiter
+
+# Лимиты Distance Matrix API на один запрос
+MAX_MATRIX_ORIGINS = 25
+MAX_MATRIX_ELEMENTS = 100
+
+# Ключевые точки для матрицы расстояний
+KEY_DESTINATIONS = (
+    "Times Square, New York, NY",
+    "Downtown Los Angeles, CA",
+    "Chicago Loop, IL"
+)
+KEY_DESTINATIONS_JOINED = '|'.join(KEY_DESTINATIONS)
+
+
+def _normalize_address(address: str) -> str:
+    """Нормализация адреса для кэширования: нижний регистр, без лишних пробелов"""
+    return ' '.join(str(address).lower().split())
+
+
+class _GeocodingFailed(Exception):
+    """Координаты адреса не получены (такой результат не кэшируется)"""
+
+
+def _json_status(response: requests.Response):
+    """Поле status JSON-ответа; None, если тело ответа не JSON"""
+    try:
+        return response.json().get('status')
+    except ValueError:
+        return None
 
 
 class GoogleMapsAPI:
@@ -30,18 +61,69 @@ class GoogleMapsAPI:
         if config_path is None:
             config_path = Path(__file__).parent.parent / 'config.yaml'
         
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = get_config(config_path)
         
         self.logger = setup_logger(config_path)
         self.api_key = self.config.get('api_keys', {}).get('google_maps', '')
         self.api_config = self.config.get('api', {}).get('google_maps', {})
         self.base_url = self.api_config.get('base_url', 'https://maps.googleapis.com/maps/api')
         self.timeout = self.api_config.get('timeout', 30)
+        self.max_workers = self.api_config.get('max_workers', 8)
+        
+        # Кэш геокодирования на экземпляре (ключ - нормализованный адрес); неудачные запросы
+        # завершаются исключением и не кэшируются, поэтому повторяются при следующем вызове
+        self._geocode_cached = functools.lru_cache(maxsize=10000)(self._geocode)
+        
+        # Общий для всех потоков лимит запросов в секунду
+        self._limiter = RateLimiter(self.api_config.get('max_requests_per_second', 50))
+        
+        # Кэш HTTP-ответов на диске (ключ API не входит в ключ кэша).
+        # Google отвечает 200 и при ошибках, поэтому кэшируются только успешные ответы со статусом OK;
+        # ошибки HTTP (в т.ч. с HTML-телом) не разбираются, а пробрасываются в raise_for_status
+        self.session = requests_cache.CachedSession(
+            'data/cache/http',
+            backend='sqlite',
+            expire_after=timedelta(days=self.api_config.get('cache_expire_days', 7)),
+            allowable_methods=['GET'],
+            ignored_parameters=['key'],
+            filter_fn=lambda response: response.ok and _json_status(response) == 'OK'
+        )
+        
+        # Пул соединений (повторы при временных ошибках выполняются в _do_get)
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
         if not self.api_key:
             self.logger.warning("API ключ Google Maps не найден в конфигурации")
     
+    def close(self):
+        """Закрытие HTTP-сессии"""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    @retry_transient
+    def _do_get(self, url: str, params: dict) -> dict:
+        """
+        GET-запрос к API с повтором при временных ошибках
+        
+        Args:
+            url: адрес запроса
+            params: параметры запроса
+            
+        Returns:
+            разобранный JSON-ответ
+        """
+        self._limiter.acquire()
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
     def _make_request(self, endpoint: str, params: dict) -> dict:
         """
         Выполнение запроса к API
@@ -58,10 +140,7 @@ class GoogleMapsAPI:
         
         try:
             self.logger.info(f"Запрос к API: {endpoint}")
-            response = requests.get(url, params=params, timeout=self.timeout)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._do_get(url, params)
             
             if data.get('status') == 'OK':
                 self.logger.info(f"Успешный ответ от API: {endpoint}")
@@ -78,11 +157,31 @@ class GoogleMapsAPI:
         """
         Запрос 1: Геокодирование адреса
         
+        Успешные результаты кэшируются в пределах экземпляра по нормализованному адресу.
+        
+        Args:
+            address: адрес для геокодирования
+            
+        Returns:
+            кортеж (широта, долгота) или (None, None), если координаты не найдены
+        """
+        try:
+            return self._geocode_cached(_normalize_address(address))
+        except _GeocodingFailed:
+            return (None, None)
+    
+    def _geocode(self, address: str) -> Tuple[float, float]:
+        """
+        Геокодирование адреса через API
+        
         Args:
             address: адрес для геокодирования
             
         Returns:
             кортеж (широта, долгота)
+            
+        Raises:
+            _GeocodingFailed: координаты не найдены или запрос не удался
         """
         self.logger.info(f"Запрос 1: Геокодирование адреса: {address}")
         
@@ -101,7 +200,7 @@ class GoogleMapsAPI:
             return (lat, lng)
         else:
             self.logger.warning(f"Не удалось найти координаты для адреса: {address}")
-            return (None, None)
+            raise _GeocodingFailed(address)
     
     def get_nearby_places(self, lat: float, lng: float, place_type: str = 'shopping_mall', radius: int = 5000) -> List[Dict]:
         """
@@ -135,13 +234,13 @@ class GoogleMapsAPI:
             self.logger.warning("Не удалось найти места")
             return []
     
-    def get_distance_matrix(self, origins: List[str], destinations: List[str], mode: str = 'driving') -> Dict:
+    def get_distance_matrix(self, origins: List[str], destinations: Union[List[str], str], mode: str = 'driving') -> Dict:
         """
         Запрос 3: Матрица расстояний
         
         Args:
             origins: список точек отправления
-            destinations: список точек назначения
+            destinations: список точек назначения или уже объединенная через '|' строка
             mode: режим передвижения (driving, walking, transit)
             
         Returns:
@@ -152,7 +251,7 @@ class GoogleMapsAPI:
         endpoint = "distancematrix/json"
         params = {
             'origins': '|'.join(origins),
-            'destinations': '|'.join(destinations),
+            'destinations': destinations if isinstance(destinations, str) else '|'.join(destinations),
             'mode': mode,
             'units': 'imperial'
         }
@@ -166,6 +265,37 @@ class GoogleMapsAPI:
             self.logger.warning("Не удалось получить матрицу расстояний")
             return {}
     
+    def get_distance_matrix_batch(self, origins: List[str], destinations: Union[List[str], str], mode: str = 'driving') -> List[Dict]:
+        """
+        Матрица расстояний для большого числа точек отправления
+        
+        Точки отправления разбиваются на группы в пределах лимитов API
+        (до 25 точек и до 100 элементов на запрос).
+        
+        Args:
+            origins: список точек отправления
+            destinations: список точек назначения или уже объединенная через '|' строка
+            mode: режим передвижения (driving, walking, transit)
+            
+        Returns:
+            список строк матрицы в порядке origins (пустой словарь, если строка не получена)
+        """
+        if not isinstance(destinations, str):
+            destinations = '|'.join(destinations)
+        n_destinations = destinations.count('|') + 1
+        chunk_size = max(1, min(MAX_MATRIX_ORIGINS, MAX_MATRIX_ELEMENTS // n_destinations))
+        
+        rows = []
+        for i in range(0, len(origins), chunk_size):
+            chunk = origins[i:i + chunk_size]
+            data = self.get_distance_matrix(chunk, destinations, mode)
+            chunk_rows = data.get('rows', []) if data else []
+            if len(chunk_rows) != len(chunk):
+                chunk_rows = [{}] * len(chunk)
+            rows.extend(chunk_rows)
+        
+        return rows
+    
     def get_directions(self, origin: str, destination: str, mode: str = 'driving') -> Dict:
         """
         Запрос 4: Маршрут между точками
@@ -234,10 +364,56 @@ class GoogleMapsAPI:
             self.logger.warning("Не удалось получить информацию о месте")
             return {}
     
+    def geocode_many(self, addresses: List[str]) -> List[Tuple[float, float]]:
+        """
+        Параллельное геокодирование списка адресов
+        
+        Повторяющиеся адреса геокодируются один раз.
+        
+        Args:
+            addresses: список адресов
+            
+        Returns:
+            список кортежей (широта, долгота) в порядке addresses
+        """
+        unique = list(dict.fromkeys(_normalize_address(address) for address in addresses))
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            coords = dict(zip(unique, executor.map(self.geocode_address, unique)))
+        
+        return [coords[_normalize_address(address)] for address in addresses]
+    
+    def _count_nearby(self, address: str, lat: float, lng: float) -> Tuple[int, int]:
+        """
+        Поиск мест поблизости для геокодированного адреса
+        
+        Args:
+            address: адрес
+            lat: широта
+            lng: долгота
+            
+        Returns:
+            кортеж (число торговых центров, число остановок транспорта)
+        """
+        self.logger.info(f"Обработка адреса: {address}")
+        
+        # Поиск ближайших торговых центров
+        nearby_malls = self.get_nearby_places(lat, lng, 'shopping_mall', 5000)
+        
+        # Поиск ближайших остановок транспорта
+        nearby_transit = self.get_nearby_places(lat, lng, 'transit_station', 2000)
+        
+        return len(nearby_malls), len(nearby_transit)
+    
     def collect_transportation_data(self, addresses: List[str]) -> pd.DataFrame:
         """
         Сбор транспортных данных для списка адресов
         
+        Сначала все адреса геокодируются параллельно, затем параллельно
+        выполняется поиск мест поблизости; общая частота запросов
+        ограничивается в _do_get. Матрица расстояний запрашивается
+        пакетно для всех найденных адресов сразу.
+        
         Args:
             addresses: список адресов
             
@@ -246,74 +422,53 @@ class GoogleMapsAPI:
         """
         self.logger.info("Начало сбора транспортных данных")
         
-        results = []
+        # Геокодирование
+        located = [
+            (address, lat, lng)
+            for address, (lat, lng) in zip(addresses, self.geocode_many(addresses))
+            if lat is not None and lng is not None
+        ]
         
-        for address in addresses:
-            self.logger.info(f"Обработка адреса: {address}")
-            
-            # Геокодирование
-            lat, lng = self.geocode_address(address)
-            if lat is None or lng is None:
-                continue
-            
-            time.sleep(0.1)  # Задержка между запросами
-            
-            # Поиск ближайших торговых центров
-            nearby_malls = self.get_nearby_places(lat, lng, 'shopping_mall', 5000)
-            mall_count = len(nearby_malls)
-            
-            time.sleep(0.1)
-            
-            # Поиск ближайших остановок транспорта
-            nearby_transit = self.get_nearby_places(lat, lng, 'transit_station', 2000)
-            transit_count = len(nearby_transit)
-            
-            time.sleep(0.1)
-            
-            # Матрица расстояний до ключевых точек
-            key_destinations = [
-                "Times Square, New York, NY",
-                "Downtown Los Angeles, CA",
-                "Chicago Loop, IL"
-            ]
-            
-            distance_data = self.get_distance_matrix([address], key_destinations, 'driving')
-            
-            min_distance = None
-            min_duration = None
-            
-            if distance_data and 'rows' in distance_data:
-                row = distance_data['rows'][0]
-                if 'elements' in row:
-                    distances = []
-                    durations = []
-                    for elem in row['elements']:
-                        if elem.get('status') == 'OK':
-                            distances.append(elem['distance']['value'])
-                            durations.append(elem['duration']['value'])
-                    
-                    if distances:
-                        min_distance = min(distances) / 1000  # в км
-                        min_duration = min(durations) / 60  # в минутах
-            
-            time.sleep(0.1)
-            
-            # Сохранение результатов
-            result = {
-                'address': address,
-                'latitude': lat,
-                'longitude': lng,
-                'nearby_malls_count': mall_count,
-                'nearby_transit_stations_count': transit_count,
-                'min_distance_to_key_location_km': min_distance,
-                'min_duration_to_key_location_min': min_duration
-            }
-            
-            results.append(result)
+        # Столбцы результата заполняются по индексу адреса
+        n = len(located)
+        located_addresses = [address for address, _, _ in located]
+        latitude = np.fromiter((lat for _, lat, _ in located), dtype=np.float64, count=n)
+        longitude = np.fromiter((lng for _, _, lng in located), dtype=np.float64, count=n)
+        malls_count = np.zeros(n, dtype=np.int32)
+        transit_count = np.zeros(n, dtype=np.int32)
+        min_distance = np.full(n, np.nan, dtype=np.float64)
+        min_duration = np.full(n, np.nan, dtype=np.float64)
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            counts = executor.map(lambda args: self._count_nearby(*args), located)
+            for i, (malls, transit) in enumerate(counts):
+                malls_count[i] = malls
+                transit_count[i] = transit
+        
+        # Матрица расстояний до ключевых точек
+        rows = self.get_distance_matrix_batch(located_addresses, KEY_DESTINATIONS_JOINED, 'driving')
+        
+        for i, row in enumerate(rows):
+            distances = []
+            durations = []
+            for elem in row.get('elements', []):
+                if elem.get('status') == 'OK':
+                    distances.append(elem['distance']['value'])
+                    durations.append(elem['duration']['value'])
             
-            time.sleep(0.2)  # Задержка между адресами
+            if distances:
+                min_distance[i] = min(distances) / 1000  # в км
+                min_duration[i] = min(durations) / 60  # в минутах
         
-        df = pd.DataFrame(results)
+        df = pd.DataFrame({
+            'address': located_addresses,
+            'latitude': latitude,
+            'longitude': longitude,
+            'nearby_malls_count': malls_count,
+            'nearby_transit_stations_count': transit_count,
+            'min_distance_to_key_location_km': min_distance,
+            'min_duration_to_key_location_min': min_duration
+        })
         self.logger.info(f"Сбор транспортных данных завершен. Всего записей: {len(df)}")
         
         return df
@@ -333,12 +488,13 @@ def main():
     ]
     
     # Сбор данных
-    df = api.collect_transportation_data(addresses)
+    with api:
+        df = api.collect_transportation_data(addresses)
     
     if not df.empty:
         # Сохранение данных
-        output_path = 'data/raw/google_maps_data.csv'
-        df.to_csv(output_path, index=False, encoding='utf-8')
+        output_path = 'data/raw/google_maps_data.parquet'
+        df.to_parquet(output_path, engine='pyarrow', compression='zstd', index=False)
         api.logger.info(f"Данные сохранены в {output_path}")
     else:
         api.logger.error("Не удалось собрать данные")
@@ -3,18 +3,112 @@ Script for combining data from all sources into a single dataset
 Объединяет данные из веб-скрапинга и API в единый датасет
 """
 import pandas as pd
-import yaml
 import os
-import sys
 from pathlib import Path
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
-# Добавление родительской директории в путь для импорта
-parent_dir = Path(__file__).parent.parent
-sys.path.insert(0, str(parent_dir))
-
+from scripts.config_cache import get_config
 from scripts.logger_config import setup_logger
-from scripts.utils import clean_text, fips_to_state_abbr
+from scripts.utils import ABBR_TO_FIPS, ARROW_TO_PANDAS_TYPES, clean_text_series, fips_to_state_abbr_series
+
+# Схемы столбцов CSV-файлов: явные типы вместо вывода типов при каждом чтении
+SCRAPING_DTYPES = {
+    'source': 'string[pyarrow]',
+    'url': 'string[pyarrow]',
+    'property_id': 'string[pyarrow]',
+    'title': 'string[pyarrow]',
+    'description': 'string[pyarrow]',
+    'price': 'float64',
+    'price_per_sqft': 'float64',
+    'square_feet': 'float64',
+    'property_type': 'string[pyarrow]',
+    'city': 'string[pyarrow]',
+    'state': 'string[pyarrow]',
+    'address': 'string[pyarrow]',
+    'year_built': 'float32',
+    'parking_spaces': 'float32',
+    'listing_date': 'string[pyarrow]'
+}
+CREXI_DTYPES = SCRAPING_DTYPES
+LOOPNET_DTYPES = SCRAPING_DTYPES
+
+CENSUS_DTYPES = {
+    'state': 'string[pyarrow]',
+    'place': 'string[pyarrow]'
+}
+
+GOOGLE_MAPS_DTYPES = {
+    'address': 'string[pyarrow]',
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'nearby_malls_count': 'float32',
+    'nearby_transit_stations_count': 'float32',
+    'min_distance_to_key_location_km': 'float64',
+    'min_duration_to_key_location_min': 'float64'
+}
+
+
+def _arrow_column_types(dtypes: dict) -> dict:
+    """
+    Перевод схемы pandas в типы столбцов Arrow для pyarrow.csv
+    
+    Args:
+        dtypes: словарь столбец -> тип pandas
+        
+    Returns:
+        словарь столбец -> тип Arrow
+    """
+    return {
+        col: pa.string() if dtype.startswith('string') else pa.from_numpy_dtype(np.dtype(dtype))
+        for col, dtype in dtypes.items()
+    }
+
+
+# Низкокардинальные строковые столбцы, хранимые как category на время объединения
+CATEGORY_COLUMNS = ('state', 'city', 'property_type', 'source')
+
+# Размер блока потокового чтения CSV (байт): ограничивает память на одну порцию строк
+CSV_BLOCK_SIZE = 64 << 20
+
+# Радиус Земли и максимальное расстояние до точки Google Maps при объединении по координатам (км)
+EARTH_RADIUS_KM = 6371.0
+MAX_COORDINATE_MATCH_KM = 0.5
+
+# Целевые типы числовых столбцов итогового датасета ('float' - float32, если значения сохраняются).
+# Столбцы с пропусками остаются float, чтобы потребители могли заполнять их нецелыми значениями
+DOWNCAST_COLUMNS = {
+    'price': 'float',
+    'square_feet': 'float',
+    'year_built': 'float',
+    'parking_spaces': 'float',
+    'description_length': 'int32',
+    'description_word_count': 'int32'
+}
+
+
+def _length_and_word_count(texts: pd.Series) -> tuple:
+    """
+    Длина и число слов очищенных текстов за один проход (без списков токенов)
+    
+    Args:
+        texts: Series string[pyarrow] после clean_text_series (одиночные пробелы, без пропусков)
+        
+    Returns:
+        кортеж массивов (длина в символах, число слов)
+    """
+    arr = pa.array(texts.array)
+    lengths = pc.utf8_length(arr)
+    # В очищенном тексте слова разделены ровно одним пробелом
+    words = pc.if_else(pc.equal(lengths, 0), 0, pc.add(pc.count_substring(arr, ' '), 1))
+    return (
+        lengths.to_numpy(zero_copy_only=False),
+        words.to_numpy(zero_copy_only=False)
+    )
 
 
 class DataCombiner:
@@ -30,16 +124,18 @@ class DataCombiner:
         if config_path is None:
             config_path = Path(__file__).parent.parent / 'config.yaml'
         
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = get_config(config_path)
         
         self.logger = setup_logger(config_path)
         self.data_dir = 'data/raw'
         self.output_dir = 'data/processed'
+        self.parquet_dir = os.path.join(self.data_dir, '_parquet')
         
-        # Создание директории для обработанных данных
+        # Создание директорий для обработанных данных и Parquet-копий CSV
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
+        if not os.path.exists(self.parquet_dir):
+            os.makedirs(self.parquet_dir)
     
     def load_scraping_data(self) -> pd.DataFrame:
         """
@@ -50,34 +146,125 @@ class DataCombiner:
         """
         self.logger.info("Загрузка данных из веб-скрапинга")
         
-        dfs = []
+        parquet_paths = []
         
         # Загрузка данных Crexi
-        crexi_path = os.path.join(self.data_dir, 'crexi_data.csv')
-        if os.path.exists(crexi_path):
-            df_crexi = pd.read_csv(crexi_path)
-            self.logger.info(f"Загружено данных из Crexi: {len(df_crexi)} записей")
-            dfs.append(df_crexi)
+        crexi_parquet = self._scraping_data_path('crexi_data', CREXI_DTYPES)
+        if crexi_parquet:
+            self.logger.info(f"Загружено данных из Crexi: {pq.read_metadata(crexi_parquet).num_rows} записей")
+            parquet_paths.append(crexi_parquet)
         else:
-            self.logger.warning(f"Файл {crexi_path} не найден")
+            self.logger.warning(f"Файл {os.path.join(self.data_dir, 'crexi_data')}.parquet/.csv не найден")
         
         # Загрузка данных LoopNet
-        loopnet_path = os.path.join(self.data_dir, 'loopnet_data.csv')
-        if os.path.exists(loopnet_path):
-            df_loopnet = pd.read_csv(loopnet_path)
-            self.logger.info(f"Загружено данных из LoopNet: {len(df_loopnet)} записей")
-            dfs.append(df_loopnet)
+        loopnet_parquet = self._scraping_data_path('loopnet_data', LOOPNET_DTYPES)
+        if loopnet_parquet:
+            self.logger.info(f"Загружено данных из LoopNet: {pq.read_metadata(loopnet_parquet).num_rows} записей")
+            parquet_paths.append(loopnet_parquet)
         else:
-            self.logger.warning(f"Файл {loopnet_path} не найден")
+            self.logger.warning(f"Файл {os.path.join(self.data_dir, 'loopnet_data')}.parquet/.csv не найден")
         
-        if dfs:
-            combined_df = pd.concat(dfs, ignore_index=True)
+        if parquet_paths:
+            # Чтение Parquet-файлов одним набором данных, перевод в pandas один раз
+            schema = pa.unify_schemas(
+                [pq.read_schema(path) for path in parquet_paths],
+                promote_options='permissive'
+            )
+            combined_table = ds.dataset(parquet_paths, schema=schema, format='parquet').to_table()
+            combined_df = combined_table.to_pandas(types_mapper=ARROW_TO_PANDAS_TYPES.get)
+            for col in CATEGORY_COLUMNS:
+                if col in combined_df.columns:
+                    combined_df[col] = combined_df[col].astype('category')
             self.logger.info(f"Всего данных из скрапинга: {len(combined_df)} записей")
             return combined_df
         else:
             self.logger.warning("Не удалось загрузить данные из скрапинга")
             return pd.DataFrame()
     
+    def _scraping_data_path(self, name: str, dtypes: dict):
+        """
+        Parquet-файл данных скрапинга: записанный скрапером или копия CSV предыдущих запусков
+        
+        Args:
+            name: имя файла без расширения
+            dtypes: типы столбцов CSV
+            
+        Returns:
+            путь к Parquet-файлу или None, если данных нет
+        """
+        parquet_path = os.path.join(self.data_dir, f'{name}.parquet')
+        if os.path.exists(parquet_path):
+            return parquet_path
+        
+        csv_path = os.path.join(self.data_dir, f'{name}.csv')
+        if os.path.exists(csv_path):
+            return self._csv_to_parquet(csv_path, dtypes)
+        
+        return None
+    
+    def _csv_to_parquet(self, csv_path: str, dtypes: dict) -> str:
+        """
+        Потоковая конвертация CSV со скрапинга в Parquet порциями фиксированного размера
+        
+        Args:
+            csv_path: путь к CSV-файлу
+            dtypes: типы столбцов
+            
+        Returns:
+            путь к Parquet-файлу (повторно используется, если CSV не изменялся)
+        """
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        parquet_path = os.path.join(self.parquet_dir, f'{name}.parquet')
+        if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path):
+            return parquet_path
+        
+        reader = pacsv.open_csv(
+            csv_path,
+            read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+            convert_options=pacsv.ConvertOptions(
+                column_types=_arrow_column_types(dtypes),
+                strings_can_be_null=True
+            )
+        )
+        
+        tmp_path = f'{parquet_path}.tmp'
+        with pq.ParquetWriter(tmp_path, reader.schema, compression='zstd') as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        os.replace(tmp_path, parquet_path)
+        
+        return parquet_path
+    
+    def _api_data_path(self, name: str) -> str:
+        """
+        Путь к файлу данных API: Parquet, если он есть, иначе CSV предыдущих запусков
+        
+        Args:
+            name: имя файла без расширения
+            
+        Returns:
+            путь к файлу
+        """
+        parquet_path = os.path.join(self.data_dir, f'{name}.parquet')
+        if os.path.exists(parquet_path):
+            return parquet_path
+        return os.path.join(self.data_dir, f'{name}.csv')
+    
+    def _read_table(self, path: str, dtypes: dict) -> pd.DataFrame:
+        """
+        Чтение таблицы из Parquet или CSV
+        
+        Args:
+            path: путь к файлу
+            dtypes: типы столбцов для чтения CSV
+            
+        Returns:
+            DataFrame с данными
+        """
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path, engine='pyarrow')
+        return pd.read_csv(path, engine='pyarrow', dtype=dtypes)
+    
     def load_api_data(self) -> tuple:
         """
         Загрузка данных из API
@@ -88,19 +275,19 @@ class DataCombiner:
         self.logger.info("Загрузка данных из API")
         
         # Загрузка данных Census Bureau
-        census_path = os.path.join(self.data_dir, 'census_data.csv')
+        census_path = self._api_data_path('census_data')
         df_census = pd.DataFrame()
         if os.path.exists(census_path):
-            df_census = pd.read_csv(census_path)
+            df_census = self._read_table(census_path, CENSUS_DTYPES)
             self.logger.info(f"Загружено данных из Census Bureau: {len(df_census)} записей")
         else:
             self.logger.warning(f"Файл {census_path} не найден")
         
         # Загрузка данных Google Maps
-        google_maps_path = os.path.join(self.data_dir, 'google_maps_data.csv')
+        google_maps_path = self._api_data_path('google_maps_data')
         df_google_maps = pd.DataFrame()
         if os.path.exists(google_maps_path):
-            df_google_maps = pd.read_csv(google_maps_path)
+            df_google_maps = self._read_table(google_maps_path, GOOGLE_MAPS_DTYPES)
             self.logger.info(f"Загружено данных из Google Maps: {len(df_google_maps)} записей")
         else:
             self.logger.warning(f"Файл {google_maps_path} не найден")
@@ -126,17 +313,14 @@ class DataCombiner:
         
         # Приведение FIPS-кодов к почтовым аббревиатурам
         df_census_state = df_census.copy()
-        df_census_state['state_fips'] = (
-            df_census_state['state']
-            .apply(lambda x: f"{int(x):02d}" if pd.notna(x) else None)
-        )
-        df_census_state['state_abbr'] = df_census_state['state_fips'].apply(fips_to_state_abbr)
+        df_census_state['state_abbr'] = fips_to_state_abbr_series(df_census_state['state'])
         df_census_state = df_census_state.dropna(subset=['state_abbr'])
+        df_census_state['state_fips'] = df_census_state['state_abbr'].map(ABBR_TO_FIPS).astype('Int16')
         
         # Агрегация по штату (средние и медианы для числовых показателей)
         candidate_cols = [
             col for col in df_census_state.columns
-            if col not in {'state', 'place', 'state_fips', 'state_abbr'}
+            if col not in {'state', 'place', 'state_abbr', 'state_fips'}
         ]
         
         for col in candidate_cols:
@@ -153,18 +337,30 @@ class DataCombiner:
             self.logger.warning("В данных Census отсутствуют числовые признаки для агрегации")
             return df
         
-        agg_dict = {col: ['mean', 'median'] for col in numeric_cols}
-        df_state_stats = df_census_state.groupby('state_abbr').agg(agg_dict)
-        df_state_stats.columns = [
-            f"census_{col}_{stat}" for col, stat in df_state_stats.columns
-        ]
-        df_state_stats = df_state_stats.reset_index().rename(columns={'state_abbr': 'state'})
+        # Средние и медианы считаются отдельно по всему блоку признаков и склеиваются по индексу штата
+        grouped = df_census_state[numeric_cols].groupby(
+            df_census_state['state_fips'], sort=False
+        )
+        df_state_stats = pd.concat(
+            [
+                grouped.mean().add_prefix('census_').add_suffix('_mean'),
+                grouped.median().add_prefix('census_').add_suffix('_median')
+            ],
+            axis=1
+        )
+        df_state_stats = df_state_stats[[
+            f"census_{col}_{stat}" for col in numeric_cols for stat in ('mean', 'median')
+        ]]
+        df_state_stats = df_state_stats.rename_axis('state_fips').reset_index()
         
+        # Соединение по 16-битному FIPS-коду штата вместо строковой аббревиатуры
+        state_fips = df['state'].map(ABBR_TO_FIPS).astype('Int16')
         df = df.merge(
             df_state_stats,
-            on='state',
+            left_on=state_fips,
+            right_on='state_fips',
             how='left'
-        )
+        ).drop(columns='state_fips')
         
         self.logger.info("Данные обогащены демографической информацией (уровень штата)")
         return df
@@ -198,15 +394,45 @@ class DataCombiner:
             # Если адреса не совпадают, можно попробовать объединить по координатам
             if 'latitude' in df.columns and 'longitude' in df.columns:
                 if 'latitude' in df_google_maps.columns and 'longitude' in df_google_maps.columns:
-                    # Объединение по ближайшим координатам (упрощенный вариант)
+                    # Объединение по ближайшим координатам
                     self.logger.info("Объединение по координатам")
-                    # Для точного объединения нужна более сложная логика
-                    # Здесь упрощенный вариант
-                    pass
+                    df = self._merge_nearest_coordinates(df, df_google_maps)
         
         self.logger.info("Данные обогащены транспортной информацией")
         return df
     
+    def _merge_nearest_coordinates(self, df: pd.DataFrame, df_google_maps: pd.DataFrame) -> pd.DataFrame:
+        """
+        Присоединение ближайшей точки Google Maps к каждому объекту (BallTree, гаверсинусная метрика)
+        
+        Args:
+            df: основной DataFrame с latitude/longitude
+            df_google_maps: DataFrame с данными Google Maps и координатами
+            
+        Returns:
+            DataFrame с транспортными признаками; объекты дальше MAX_COORDINATE_MATCH_KM остаются без данных
+        """
+        # scikit-learn нужен только для этого запасного варианта объединения
+        from sklearn.neighbors import BallTree
+        
+        coords_g = df_google_maps[['latitude', 'longitude']].to_numpy(dtype=np.float64, na_value=np.nan)
+        coords = df[['latitude', 'longitude']].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid_g = np.flatnonzero(np.isfinite(coords_g).all(axis=1))
+        valid = np.isfinite(coords).all(axis=1)
+        
+        # Позиция строки Google Maps для каждого объекта (-1 - совпадения нет)
+        positions = np.full(len(df), -1, dtype=np.intp)
+        if valid_g.size and valid.any():
+            tree = BallTree(np.deg2rad(coords_g[valid_g]), metric='haversine')
+            dist, idx = tree.query(np.deg2rad(coords[valid]), k=1)
+            dist_km = dist[:, 0] * EARTH_RADIUS_KM
+            positions[valid] = np.where(dist_km <= MAX_COORDINATE_MATCH_KM, valid_g[idx[:, 0]], -1)
+        
+        matched = df_google_maps.reset_index(drop=True).reindex(positions)
+        matched.index = df.index
+        
+        return df.join(matched, lsuffix='', rsuffix='_transport')
+    
     def clean_and_prepare_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """
         Очистка и подготовка данных
@@ -223,11 +449,13 @@ class DataCombiner:
         text_columns = ['title', 'description', 'address']
         for col in text_columns:
             if col in df.columns:
-                df[col] = df[col].apply(clean_text)
+                df[col] = clean_text_series(df[col])
         
-        # Удаление дубликатов
+        # Удаление дубликатов по кодам категорий URL, а не по полным строкам
         initial_count = len(df)
-        df = df.drop_duplicates(subset=['url'], keep='first')
+        url_dtype = df['url'].dtype
+        df['url'] = df['url'].astype('category')
+        df = df.drop_duplicates(subset=['url'], keep='first').astype({'url': url_dtype})
         removed = initial_count - len(df)
         if removed > 0:
             self.logger.info(f"Удалено дубликатов: {removed}")
@@ -235,12 +463,28 @@ class DataCombiner:
         # Создание целевой переменной (цена за квадратный фут)
         if 'price_per_sqft' not in df.columns:
             if 'price' in df.columns and 'square_feet' in df.columns:
-                df['price_per_sqft'] = df['price'] / df['square_feet']
+                # Деление только при конечных значениях и положительной площади: без 0/inf в результате
+                price = df['price'].to_numpy(dtype=np.float32, na_value=np.nan)
+                square_feet = df['square_feet'].to_numpy(dtype=np.float32, na_value=np.nan)
+                valid = (square_feet > 0) & np.isfinite(square_feet) & np.isfinite(price)
+                price_per_sqft = np.full(len(df), np.nan, dtype=np.float32)
+                np.divide(price, square_feet, out=price_per_sqft, where=valid)
+                df['price_per_sqft'] = price_per_sqft
         
         # Создание дополнительных признаков
         if 'description' in df.columns:
-            df['description_length'] = df['description'].str.len()
-            df['description_word_count'] = df['description'].str.split().str.len()
+            df['description_length'], df['description_word_count'] = _length_and_word_count(df['description'])
+        
+        # Тип category нужен только при объединении и удалении дубликатов: в итоговый датасет
+        # столбцы попадают строками, чтобы потребители могли дописывать новые значения
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('string[pyarrow]')
+        
+        # Сжатие числовых столбцов после расчета производных признаков
+        for col, target in DOWNCAST_COLUMNS.items():
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], downcast='float') if target == 'float' else df[col].astype(target)
         
         self.logger.info("Данные очищены и подготовлены")
         return df
@@ -279,16 +523,19 @@ class DataCombiner:
         
         return df_final
     
-    def save_combined_data(self, df: pd.DataFrame, filename: str = 'combined_dataset.csv'):
+    def save_combined_data(self, df: pd.DataFrame, filename: str = 'combined_dataset.parquet'):
         """
         Сохранение объединенного датасета
         
         Args:
             df: DataFrame для сохранения
-            filename: имя файла
+            filename: имя файла (Parquet; CSV, если расширение .csv)
         """
         output_path = os.path.join(self.output_dir, filename)
-        df.to_csv(output_path, index=False, encoding='utf-8')
+        if filename.endswith('.csv'):
+            df.to_csv(output_path, index=False, encoding='utf-8')
+        else:
+            df.to_parquet(output_path, engine='pyarrow', compression='zstd', index=False)
         self.logger.info(f"Объединенный датасет сохранен в {output_path}")
 
 
@@ -0,0 +1,45 @@
+"""
+Config cache module
+Кэширование разобранного config.yaml в пределах процесса
+"""
+import functools
+import os
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+
+@functools.lru_cache(maxsize=8)
+def _load(path_str: str, mtime_ns: int) -> dict:
+    """
+    Чтение и разбор YAML-файла (кэшируется по пути и времени изменения)
+
+    Args:
+        path_str: путь к файлу конфигурации
+        mtime_ns: время последнего изменения файла в наносекундах
+
+    Returns:
+        словарь с конфигурацией
+    """
+    with open(path_str, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=_Loader)
+
+
+def get_config(path) -> dict:
+    """
+    Получение конфигурации с повторным разбором только при изменении файла
+
+    Возвращаемый словарь общий для всех вызывающих, его не следует изменять.
+
+    Args:
+        path: путь к файлу конфигурации
+
+    Returns:
+        словарь с конфигурацией
+    """
+    st = os.stat(path)
+    return _load(str(path), st.st_mtime_ns)
@@ -0,0 +1,39 @@
+"""
+HTTP retry module
+Повтор запросов к API при временных сетевых ошибках
+"""
+import requests
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+# HTTP-статусы, при которых запрос имеет смысл повторить
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Проверка, является ли ошибка запроса временной"""
+    if isinstance(exc, requests.exceptions.HTTPError):
+        response = exc.response
+        return response is not None and response.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(exc, (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError
+    ))
+
+
+def _log_retry(retry_state):
+    """Логирование повторной попытки через логгер API клиента"""
+    client = retry_state.args[0]
+    client.logger.warning(
+        f"Повтор запроса ({retry_state.attempt_number}) после ошибки: {retry_state.outcome.exception()}"
+    )
+
+
+# Экспоненциальная задержка со случайным разбросом, исходная ошибка пробрасывается после последней попытки
+retry_transient = retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(multiplier=0.5, max=8),
+    retry=retry_if_exception(_is_transient),
+    before_sleep=_log_retry,
+    reraise=True
+)
@@ -4,27 +4,57 @@ Logger configuration module
 """
 import logging
 import os
-import yaml
+import threading
 from logging.handlers import RotatingFileHandler
 
+from scripts.config_cache import get_config
+
+# Все модули пишут в один именованный логгер; запоминается, какой конфигурацией
+# (путь и время изменения файла) он настроен, и сам результат настройки
+_configured = {}
+_configured_lock = threading.Lock()
+
 
 def setup_logger(config_path=None):
     """
     Настройка логгера на основе конфигурационного файла
     
+    Повторные вызовы с тем же неизмененным файлом конфигурации возвращают уже
+    настроенный логгер без повторного создания обработчиков; вызов с другим файлом
+    (или после изменения файла) настраивает логгер заново.
+    
     Args:
         config_path: путь к файлу конфигурации
         
     Returns:
         logger: настроенный объект логгера
     """
-    # Загрузка конфигурации
     if config_path is None:
         from pathlib import Path
         config_path = Path(__file__).parent.parent / 'config.yaml'
     
-    with open(config_path, 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
+    config_path = os.path.abspath(config_path)
+    config_key = (config_path, os.stat(config_path).st_mtime_ns)
+    
+    with _configured_lock:
+        if _configured.get('key') != config_key:
+            _configured['logger'] = _setup_logger(config_path)
+            _configured['key'] = config_key
+        return _configured['logger']
+
+
+def _setup_logger(config_path: str):
+    """
+    Настройка логгера по файлу конфигурации
+    
+    Args:
+        config_path: абсолютный путь к файлу конфигурации
+        
+    Returns:
+        logger: настроенный объект логгера
+    """
+    # Загрузка конфигурации
+    config = get_config(config_path)
     
     log_config = config.get('logging', {})
     
@@ -43,8 +73,10 @@ def setup_logger(config_path=None):
     logger = logging.getLogger('commercial_real_estate')
     logger.setLevel(getattr(logging, log_config.get('level', 'INFO')))
     
-    # Очистка существующих обработчиков
-    logger.handlers.clear()
+    # Удаление существующих обработчиков с закрытием файлов (при настройке другим файлом конфигурации)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
     
     # Формат логирования
     formatter = logging.Formatter(log_config.get('format', 
@@ -0,0 +1,40 @@
+"""
+Rate limiter module
+Потокобезопасное ограничение частоты запросов (token bucket)
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    """Ограничитель частоты запросов по алгоритму token bucket"""
+
+    def __init__(self, rate: float, capacity: int = None):
+        """
+        Инициализация ограничителя
+
+        Args:
+            rate: допустимое количество запросов в секунду
+            capacity: максимальный размер всплеска (по умолчанию равен rate)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Ожидание свободного токена перед выполнением запроса"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
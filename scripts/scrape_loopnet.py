@@ -2,27 +2,96 @@
 Web scraping script for LoopNet commercial real estate portal
 Использует requests/bs4 и Selenium для сбора данных
 """
+import os
+import re
 import time
-import yaml
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup, SoupStrainer, UnicodeDammit
+from lxml import etree
+from lxml import html as lxml_html
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
-import sys
 from pathlib import Path
 
-# Добавление родительской директории в путь для импорта
-parent_dir = Path(__file__).parent.parent
-sys.path.insert(0, str(parent_dir))
-
+from scripts.config_cache import get_config
 from scripts.logger_config import setup_logger
-from scripts.utils import clean_text, parse_price, parse_square_feet, extract_city_state
+from scripts.rate_limiter import RateLimiter
+from scripts.utils import (
+    PROPERTY_SCHEMA, clean_text, parse_price, parse_square_feet, extract_city_state
+)
+
+# Идентификатор объекта в URL
+PROPERTY_ID_RE = re.compile(r'/(?:property|listing)/([^/?#]+)')
+
+# Ресурсы, не нужные для извлечения данных: браузер их не загружает
+BLOCKED_RESOURCE_URLS = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.woff', '*.woff2', '*.css']
+
+# Разбор только ссылок на странице поиска
+SEARCH_PAGE_STRAINER = SoupStrainer('a', href=True)
+
+# Объявление кодировки в meta-теге ищется в начале документа
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset', re.IGNORECASE)
+META_CHARSET_SCAN_BYTES = 1024
+
+
+def _has_class(*class_names: str) -> str:
+    """Условие XPath, эквивалентное CSS-селектору по классу (.name)"""
+    return ' or '.join(
+        f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')" for name in class_names
+    )
+
+
+# Поля страницы объекта: первый подходящий элемент в порядке документа, как у select_one
+TITLE_XPATH = etree.XPath(f"(//h1 | //*[{_has_class('property-title')}])[1]")
+DESCRIPTION_XPATH = etree.XPath(f"(//*[{_has_class('description', 'property-description')}])[1]")
+PRICE_XPATH = etree.XPath(f"(//*[{_has_class('price', 'property-price')}])[1]")
+SQFT_XPATH = etree.XPath(f"(//*[{_has_class('square-feet', 'sqft')}])[1]")
+LOCATION_XPATH = etree.XPath(f"(//*[{_has_class('location', 'address')}])[1]")
+# Только мета-теги Open Graph с заголовком и описанием
+OG_META_XPATH = etree.XPath("//meta[@property='og:title' or @property='og:description']")
+
+
+def _first(xpath: etree.XPath, tree) -> object:
+    """Первый элемент, найденный выражением XPath, или None"""
+    found = xpath(tree)
+    return found[0] if found else None
+
+
+def _parse_html(response) -> object:
+    """
+    Разбор HTML-страницы прямо из байтов ответа
+    
+    Кодировку определяет lxml: по charset из заголовка Content-Type или по meta-тегу документа.
+    UnicodeDammit (полное декодирование страницы) используется, только если кодировка
+    нигде не объявлена или разбор с объявленной кодировкой не удался.
+    
+    Args:
+        response: ответ requests со страницей
+        
+    Returns:
+        корневой элемент дерева lxml
+    """
+    content = response.content
+    declared = 'charset' in response.headers.get('Content-Type', '').lower()
+    if declared or META_CHARSET_RE.search(content, 0, META_CHARSET_SCAN_BYTES):
+        try:
+            if declared:
+                return lxml_html.fromstring(content, parser=lxml_html.HTMLParser(encoding=response.encoding))
+            return lxml_html.fromstring(content)
+        except (etree.ParserError, LookupError, ValueError):
+            pass
+    encoding = UnicodeDammit(content, is_html=True).original_encoding
+    return lxml_html.fromstring(content, parser=lxml_html.HTMLParser(encoding=encoding))
 
 
 class LoopNetScraper:
@@ -38,8 +107,7 @@ class LoopNetScraper:
         if config_path is None:
             config_path = Path(__file__).parent.parent / 'config.yaml'
         
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = get_config(config_path)
         
         self.logger = setup_logger(config_path)
         self.scraping_config = self.config.get('scraping', {}).get('loopnet', {})
@@ -47,14 +115,30 @@ class LoopNetScraper:
         self.delay = self.scraping_config.get('delay_between_requests', 2)
         self.use_selenium = self.scraping_config.get('use_selenium', True)
         self.headless = self.scraping_config.get('headless', True)
+        self.page_load_timeout = self.scraping_config.get('page_load_timeout', 10)
+        self.max_workers = self.scraping_config.get('max_workers', 4)
+        self.batch_size = self.scraping_config.get('batch_size', 1000)
+        self.output_path = os.path.join('data', 'raw', 'loopnet_data.parquet')
         
         self.driver = None
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # Общий для всех потоков лимит частоты: delay_between_requests - пауза между любыми двумя
+        # запросами к сайту; более высокую частоту можно явно задать ключом max_requests_per_second
+        default_rate = 1 / self.delay if self.delay > 0 else None
+        rate = self.scraping_config.get('max_requests_per_second', default_rate)
+        self._limiter = RateLimiter(rate) if rate else None
         
+        # Буфер собранных объектов; каждые batch_size записей сбрасывается в Parquet
         self.properties = []
+        self.collected = 0
+        self._pq_writer = None
         
     def _init_driver(self):
         """Инициализация Selenium WebDriver"""
@@ -67,11 +151,17 @@ class LoopNetScraper:
             chrome_options.add_argument('--disable-blink-features=AutomationControlled')
             chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
             chrome_options.add_experimental_option('useAutomationExtension', False)
+            # Отключение загрузки изображений
+            chrome_options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
             
             service = Service(ChromeDriverManager().install())
             self.driver = webdriver.Chrome(service=service, options=chrome_options)
             self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
             
+            # Блокировка стилей, шрифтов и картинок через Chrome DevTools Protocol
+            self.driver.execute_cdp_cmd('Network.enable', {})
+            self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_RESOURCE_URLS})
+            
             self.logger.info("Selenium WebDriver инициализирован")
     
     def _close_driver(self):
@@ -81,6 +171,20 @@ class LoopNetScraper:
             self.driver = None
             self.logger.info("Selenium WebDriver закрыт")
     
+    def _wait_for(self, css_selector: str):
+        """
+        Ожидание появления элемента на странице вместо фиксированной паузы
+        
+        Args:
+            css_selector: CSS-селектор ожидаемого элемента
+        """
+        try:
+            WebDriverWait(self.driver, self.page_load_timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, css_selector))
+            )
+        except TimeoutException:
+            self.logger.debug(f"Элемент {css_selector} не появился за {self.page_load_timeout} с")
+    
     def scrape_search_page(self, url: str) -> list:
         """
         Скрапинг страницы поиска
@@ -97,7 +201,7 @@ class LoopNetScraper:
             self._init_driver()
             try:
                 self.driver.get(url)
-                time.sleep(3)  # Ожидание загрузки
+                self._wait_for('a[href*="/property/"], a[href*="/listing/"]')  # Ожидание загрузки
                 
                 # Имитация работы пользователя - прокрутка страницы
                 self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight/2);")
@@ -106,15 +210,15 @@ class LoopNetScraper:
                 time.sleep(2)
                 
                 # Поиск ссылок на объекты
-                property_links = []
+                property_links = set()
                 elements = self.driver.find_elements(By.CSS_SELECTOR, 'a[href*="/property/"], a[href*="/listing/"]')
                 for elem in elements:
                     href = elem.get_attribute('href')
-                    if href and href not in property_links:
-                        property_links.append(href)
+                    if href:
+                        property_links.add(href)
                 
                 self.logger.info(f"Найдено {len(property_links)} ссылок на объекты")
-                return property_links
+                return list(property_links)
                 
             except Exception as e:
                 self.logger.error(f"Ошибка при скрапинге страницы поиска: {e}")
@@ -123,18 +227,17 @@ class LoopNetScraper:
             try:
                 response = self.session.get(url, timeout=30)
                 response.raise_for_status()
-                soup = BeautifulSoup(response.content, 'html.parser')
+                soup = BeautifulSoup(response.content, 'lxml', parse_only=SEARCH_PAGE_STRAINER)
                 
-                property_links = []
+                property_links = set()
                 for link in soup.find_all('a', href=True):
                     href = link['href']
                     if '/property/' in href or '/listing/' in href:
                         full_url = href if href.startswith('http') else self.base_url + href
-                        if full_url not in property_links:
-                            property_links.append(full_url)
+                        property_links.add(full_url)
                 
                 self.logger.info(f"Найдено {len(property_links)} ссылок на объекты")
-                return property_links
+                return list(property_links)
                 
             except Exception as e:
                 self.logger.error(f"Ошибка при скрапинге страницы поиска: {e}")
@@ -174,7 +277,7 @@ class LoopNetScraper:
             if self.use_selenium:
                 self._init_driver()
                 self.driver.get(url)
-                time.sleep(2)
+                self._wait_for('h1, .property-title, [data-testid="property-title"]')
                 
                 # Имитация работы пользователя
                 self.driver.execute_script("window.scrollTo(0, 500);")
@@ -223,62 +326,56 @@ class LoopNetScraper:
                 
                 # Получение HTML для дополнительного парсинга
                 html = self.driver.page_source
-                soup = BeautifulSoup(html, 'html.parser')
+                tree = lxml_html.fromstring(html)
                 
             else:
                 response = self.session.get(url, timeout=30)
                 response.raise_for_status()
-                soup = BeautifulSoup(response.content, 'html.parser')
+                tree = _parse_html(response)
                 
-                # Извлечение данных через BeautifulSoup
-                title_elem = soup.select_one('h1, .property-title')
-                if title_elem:
-                    property_data['title'] = clean_text(title_elem.get_text())
+                # Извлечение данных заранее скомпилированными выражениями XPath
+                title_elem = _first(TITLE_XPATH, tree)
+                if title_elem is not None:
+                    property_data['title'] = clean_text(title_elem.text_content())
                 
-                desc_elem = soup.select_one('.description, .property-description')
-                if desc_elem:
-                    property_data['description'] = clean_text(desc_elem.get_text())
+                desc_elem = _first(DESCRIPTION_XPATH, tree)
+                if desc_elem is not None:
+                    property_data['description'] = clean_text(desc_elem.text_content())
                 
-                price_elem = soup.select_one('.price, .property-price')
-                if price_elem:
-                    price_text = price_elem.get_text()
+                price_elem = _first(PRICE_XPATH, tree)
+                if price_elem is not None:
+                    price_text = price_elem.text_content()
                     property_data['price'] = parse_price(price_text)
                 
-                sqft_elem = soup.select_one('.square-feet, .sqft')
-                if sqft_elem:
-                    sqft_text = sqft_elem.get_text()
+                sqft_elem = _first(SQFT_XPATH, tree)
+                if sqft_elem is not None:
+                    sqft_text = sqft_elem.text_content()
                     property_data['square_feet'] = parse_square_feet(sqft_text)
                     if property_data['price'] and property_data['square_feet']:
                         property_data['price_per_sqft'] = property_data['price'] / property_data['square_feet']
                 
-                location_elem = soup.select_one('.location, .address')
-                if location_elem:
-                    location_text = location_elem.get_text()
+                location_elem = _first(LOCATION_XPATH, tree)
+                if location_elem is not None:
+                    location_text = location_elem.text_content()
                     property_data['address'] = clean_text(location_text)
                     city, state = extract_city_state(location_text)
                     property_data['city'] = city
                     property_data['state'] = state
             
             # Дополнительное извлечение из мета-тегов
-            meta_tags = soup.find_all('meta')
-            for meta in meta_tags:
-                prop = meta.get('property', '')
+            for meta in OG_META_XPATH(tree):
+                prop = meta.get('property')
                 content = meta.get('content', '')
                 
-                if 'og:title' in prop:
-                    if not property_data['title']:
-                        property_data['title'] = clean_text(content)
-                elif 'og:description' in prop:
-                    if not property_data['description']:
-                        property_data['description'] = clean_text(content)
+                if prop == 'og:title' and not property_data['title']:
+                    property_data['title'] = clean_text(content)
+                elif prop == 'og:description' and not property_data['description']:
+                    property_data['description'] = clean_text(content)
             
             # Извлечение ID из URL
-            if '/property/' in url or '/listing/' in url:
-                parts = url.split('/')
-                for i, part in enumerate(parts):
-                    if part in ['property', 'listing'] and i + 1 < len(parts):
-                        property_data['property_id'] = parts[i + 1].split('/')[0]
-                        break
+            id_match = PROPERTY_ID_RE.search(url)
+            if id_match:
+                property_data['property_id'] = id_match.group(1)
             
             self.logger.debug(f"Данные объекта извлечены: {property_data['title']}")
             
@@ -287,7 +384,7 @@ class LoopNetScraper:
         
         return property_data
     
-    def scrape_multiple_pages(self, search_urls: list, max_properties: int = 10000) -> pd.DataFrame:
+    def scrape_multiple_pages(self, search_urls: list, max_properties: int = 10000) -> int:
         """
         Скрапинг нескольких страниц поиска
         
@@ -296,45 +393,117 @@ class LoopNetScraper:
             max_properties: максимальное количество объектов для сбора
             
         Returns:
-            DataFrame с собранными данными
+            число собранных объектов (данные записываются в self.output_path)
         """
         self.logger.info(f"Начало сбора данных с LoopNet. Максимум объектов: {max_properties}")
         
-        all_property_links = []
+        # Буфер и запись предыдущего (в т.ч. прерванного) запуска не переносятся в новый
+        self.properties.clear()
+        self.collected = 0
+        if self._pq_writer is not None:
+            self._pq_writer.close()
+            self._pq_writer = None
+        
+        all_property_links = set()
         
         # Сбор ссылок на объекты
         for search_url in search_urls:
             links = self.scrape_search_page(search_url)
-            all_property_links.extend(links)
+            all_property_links.update(links)
             time.sleep(self.delay)
             
             if len(all_property_links) >= max_properties:
                 break
         
-        # Удаление дубликатов
-        all_property_links = list(set(all_property_links))[:max_properties]
+        # Дубликаты уже отброшены множеством
+        all_property_links = list(all_property_links)[:max_properties]
         self.logger.info(f"Всего уникальных ссылок: {len(all_property_links)}")
         
         # Скрапинг объектов
-        for i, link in enumerate(all_property_links, 1):
-            if len(self.properties) >= max_properties:
-                break
-            
-            property_data = self.scrape_property(link)
-            if property_data.get('title') or property_data.get('description'):
-                self.properties.append(property_data)
-            
-            if i % 10 == 0:
-                self.logger.info(f"Обработано объектов: {len(self.properties)}/{len(all_property_links)}")
-            
-            time.sleep(self.delay)
+        if self.use_selenium:
+            # Один браузер на скрапер, поэтому объекты обходятся последовательно
+            for i, link in enumerate(all_property_links, 1):
+                if self.collected >= max_properties:
+                    break
+                
+                property_data = self.scrape_property(link)
+                if property_data.get('title') or property_data.get('description'):
+                    self._add_property(property_data)
+                
+                if i % 10 == 0:
+                    self.logger.info(f"Обработано объектов: {self.collected}/{len(all_property_links)}")
+                
+                time.sleep(self.delay)
+        else:
+            self._scrape_properties_parallel(all_property_links)
         
         self._close_driver()
+        self._close_writer()
+        
+        # Данные не читаются обратно в память: объем ограничен буфером batch_size
+        self.logger.info(f"Сбор данных завершен. Всего собрано: {self.collected} объектов")
+        
+        return self.collected
+    
+    def _scrape_property_limited(self, url: str) -> dict:
+        """
+        Скрапинг объекта с соблюдением общего лимита частоты запросов
+        
+        Args:
+            url: URL объекта
+            
+        Returns:
+            словарь с данными объекта
+        """
+        if self._limiter is not None:
+            self._limiter.acquire()
+        return self.scrape_property(url)
+    
+    def _scrape_properties_parallel(self, links: list):
+        """
+        Параллельный скрапинг объектов через requests (без Selenium)
         
-        df = pd.DataFrame(self.properties)
-        self.logger.info(f"Сбор данных завершен. Всего собрано: {len(df)} объектов")
+        Args:
+            links: список URL объектов
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(self._scrape_property_limited, links)
+            for i, property_data in enumerate(results, 1):
+                if property_data.get('title') or property_data.get('description'):
+                    self._add_property(property_data)
+                
+                if i % 10 == 0:
+                    self.logger.info(f"Обработано объектов: {self.collected}/{len(links)}")
+    
+    def _add_property(self, property_data: dict):
+        """
+        Добавление объекта в буфер со сбросом в Parquet при заполнении
         
-        return df
+        Args:
+            property_data: словарь с данными объекта
+        """
+        self.properties.append(property_data)
+        self.collected += 1
+        if len(self.properties) >= self.batch_size:
+            self._flush_properties()
+    
+    def _flush_properties(self):
+        """Запись буфера объектов во временный Parquet-файл и очистка буфера"""
+        if self._pq_writer is None:
+            os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+            self._pq_writer = pq.ParquetWriter(f'{self.output_path}.tmp', PROPERTY_SCHEMA, compression='zstd')
+        
+        if self.properties:
+            # Типизированные столбцы собираются в Arrow по явной схеме
+            self._pq_writer.write_table(pa.Table.from_pylist(self.properties, schema=PROPERTY_SCHEMA))
+            self.properties.clear()
+    
+    def _close_writer(self):
+        """Запись остатка буфера и замена выходного файла завершенным Parquet"""
+        self._flush_properties()
+        self._pq_writer.close()
+        self._pq_writer = None
+        os.replace(f'{self.output_path}.tmp', self.output_path)
 
 
 def main():
@@ -350,13 +519,9 @@ def main():
         f"{scraper.base_url}/search/commercial-real-estate/phoenix-az",
     ]
     
-    # Сбор данных
-    df = scraper.scrape_multiple_pages(search_urls, max_properties=5000)
-    
-    # Сохранение данных
-    output_path = 'data/raw/loopnet_data.csv'
-    df.to_csv(output_path, index=False, encoding='utf-8')
-    scraper.logger.info(f"Данные сохранены в {output_path}")
+    # Сбор данных (записываются в Parquet по мере сбора)
+    collected = scraper.scrape_multiple_pages(search_urls, max_properties=5000)
+    scraper.logger.info(f"Данные сохранены в {scraper.output_path}: {collected} записей")
 
 
 if __name__ == '__main__':
@@ -1,9 +1,12 @@
 """
 Utility functions for data processing
 """
+import functools
 import re
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from typing import List, Dict, Any, Optional
 
 
@@ -61,6 +64,67 @@ FIPS_TO_STATE = {
     "56": "WY"
 }
 
+# Схема записи об объекте недвижимости, собираемой скраперами (порядок столбцов выходного CSV)
+PROPERTY_SCHEMA = pa.schema([
+    ('source', pa.string()),
+    ('url', pa.string()),
+    ('property_id', pa.string()),
+    ('title', pa.string()),
+    ('description', pa.string()),
+    ('price', pa.float64()),
+    ('price_per_sqft', pa.float64()),
+    ('square_feet', pa.float64()),
+    ('property_type', pa.string()),
+    ('city', pa.string()),
+    ('state', pa.string()),
+    ('address', pa.string()),
+    ('year_built', pa.int16()),
+    ('parking_spaces', pa.int16()),
+    ('listing_date', pa.string())
+])
+
+# Строковые столбцы Arrow остаются в Arrow-памяти и после перевода в pandas
+ARROW_TO_PANDAS_TYPES = {pa.string(): pd.StringDtype('pyarrow')}
+
+# Кэш clean_text: только короткие строки (названия, типы объектов, города), которые повторяются;
+# длинные описания почти уникальны и очищаются без кэша
+CLEAN_TEXT_CACHE_SIZE = 4096
+CLEAN_TEXT_CACHE_MAX_LENGTH = 100
+
+# Регулярные выражения компилируются один раз при импорте модуля
+_WHITESPACE_RE = re.compile(r'\s+')
+_SPECIAL_CHARS_RE = re.compile(r'[^\w\s.,!?;:()\-\'"]+')
+_ALREADY_CLEAN_RE = re.compile(r'[\w.,!?;:()\-\'" ]*')
+# Цифры в ценах и площадях - только ASCII 0-9: так float() и pd.to_numeric в векторных
+# версиях разбирают одни и те же строки
+_PRICE_JUNK_RE = re.compile(r'[^0-9.]+')
+_SQFT_NUMBER_RE = re.compile(r'([0-9,]+)')
+
+# Таблица str.translate, удаляющая те же ASCII-символы, что и _SPECIAL_CHARS_RE
+_ASCII_SPECIAL_CHARS_TABLE = str.maketrans(
+    '', '', ''.join(chr(code) for code in range(128) if _SPECIAL_CHARS_RE.match(chr(code)))
+)
+
+# Обратное соответствие: почтовая аббревиатура -> целый FIPS-код штата
+ABBR_TO_FIPS = {abbr: int(code) for code, abbr in FIPS_TO_STATE.items()}
+
+# Соответствие по целому FIPS-коду: числовые коды ищутся без форматирования строки
+FIPS_INT_TO_STATE = {int(code): abbr for code, abbr in FIPS_TO_STATE.items()}
+
+# Аббревиатуры штатов (категории) и таблица кодов категорий, индексируемая целым FIPS-кодом
+STATE_ABBRS = sorted(FIPS_TO_STATE.values())
+_FIPS_CATEGORY_CODES = np.full(max(int(code) for code in FIPS_TO_STATE) + 1, -1, dtype=np.int8)
+for _code, _abbr in FIPS_TO_STATE.items():
+    _FIPS_CATEGORY_CODES[int(_code)] = STATE_ABBRS.index(_abbr)
+
+# Плотная таблица аббревиатур, индексируемая целым FIPS-кодом (None для кодов без штата)
+_FIPS_TABLE = np.array(STATE_ABBRS + [None], dtype=object)[_FIPS_CATEGORY_CODES]
+
+# Ключи и значения FIPS -> штат в виде Arrow-массивов для fips_to_state_abbr_arrow
+_ARROW_FIPS_KEYS = pa.array(list(FIPS_TO_STATE.keys()))
+_ARROW_FIPS_INT_KEYS = pa.array([int(code) for code in FIPS_TO_STATE], type=pa.int64())
+_ARROW_FIPS_STATES = pa.array(list(FIPS_TO_STATE.values()))
+
 
 def clean_text(text: str) -> str:
     """
@@ -72,24 +136,98 @@ def clean_text(text: str) -> str:
     Returns:
         очищенный текст
     """
-    if pd.isna(text) or text is None:
-        return ""
-    
-    text = str(text)
+    # Строки (основной случай) проверяются isinstance без обращения к pd.isna
+    if not isinstance(text, str):
+        if text is None or pd.isna(text):
+            return ""
+        text = str(text)
     
-    # Удаление лишних пробелов
-    text = re.sub(r'\s+', ' ', text)
+    if len(text) <= CLEAN_TEXT_CACHE_MAX_LENGTH:
+        return _clean_text_cached(text)
+    return _clean_text_str(text)
+
+
+def _clean_text_str(text: str) -> str:
+    """Очистка строки (без обработки пропусков)"""
+    # Строка без спецсимволов и без пробельных последовательностей требует только обрезки
+    if _ALREADY_CLEAN_RE.fullmatch(text) and '  ' not in text:
+        return text.strip()
     
-    # Удаление специальных символов, но сохранение букв, цифр и основных знаков препинания
-    text = re.sub(r'[^\w\s.,!?;:()\-\'"]', '', text)
+    # Удаление специальных символов, но сохранение букв, цифр и основных знаков препинания;
+    # ASCII-строки обрабатываются табличным str.translate без регулярного выражения
+    if text.isascii():
+        text = text.translate(_ASCII_SPECIAL_CHARS_TABLE)
+    else:
+        text = _SPECIAL_CHARS_RE.sub('', text)
     
-    # Удаление множественных пробелов
-    text = re.sub(r' +', ' ', text)
+    # Схлопывание пробелов (включая оставшиеся рядом после удаления символов)
+    text = _WHITESPACE_RE.sub(' ', text)
     
     # Удаление пробелов в начале и конце
-    text = text.strip()
+    return text.strip()
+
+
+# Повторяющиеся короткие значения берутся из кэша
+_clean_text_cached = functools.lru_cache(maxsize=CLEAN_TEXT_CACHE_SIZE)(_clean_text_str)
+
+
+# Шаблоны векторных функций для RE2 (pyarrow.compute): \w и \s в RE2 только ASCII, поэтому классы
+# символов заданы явно, чтобы совпадать с Unicode-семантикой модуля re
+_ARROW_WHITESPACE_CHARS = (
+    r'\t\n\x{0b}\f\r\x{1c}-\x{1f} \x{85}\x{a0}\x{1680}\x{2000}-\x{200a}'
+    r'\x{2028}\x{2029}\x{202f}\x{205f}\x{3000}'
+)
+_ARROW_WHITESPACE_RE = f'[{_ARROW_WHITESPACE_CHARS}]+'
+_ARROW_SPECIAL_CHARS_RE = f'[^\\p{{L}}\\p{{N}}_{_ARROW_WHITESPACE_CHARS}.,!?;:()\\-\'"]+'
+_ARROW_PRICE_JUNK_RE = r'[^0-9.]+'
+_ARROW_SQFT_NUMBER_RE = r'(?P<number>[0-9,]+)'
+_ARROW_CITY_STATE_RE = f'(?P<city>[^,]+),[{_ARROW_WHITESPACE_CHARS}]*(?P<state>[A-Z]{{2}})'
+
+
+def _arrow_strings(values: pd.Series) -> pa.Array:
+    """Строки Series в виде Arrow-массива (для string[pyarrow] без копирования)"""
+    arr = pa.array(values.astype('string[pyarrow]').array)
+    return arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr
+
+
+def _unique_strings(values: pd.Series) -> pa.DictionaryArray:
+    """
+    Словарное кодирование строк Series: парсеры обрабатывают только уникальные значения
+    (цены, площади и локации в выгрузках сильно повторяются), а результат раздаётся по индексам
+    """
+    return pc.dictionary_encode(_arrow_strings(values))
+
+
+def _take_floats(numbers: pa.Array, indices: pa.Array, values: pd.Series) -> pd.Series:
+    """Перевод строк словаря в float64 и раздача по строкам Series; нераспознанные -> NaN"""
+    parsed = pd.to_numeric(pd.Series(pd.arrays.ArrowStringArray(numbers)), errors='coerce')
+    parsed = np.append(parsed.to_numpy(dtype=np.float64, na_value=np.nan), np.nan)
+    
+    # Пропуски получают индекс дополнительного NaN в конце словаря
+    codes = pc.fill_null(indices, len(numbers)).to_numpy()
+    return pd.Series(parsed[codes], index=values.index, name=values.name)
+
+
+def clean_text_series(texts: pd.Series) -> pd.Series:
+    """
+    Векторная очистка текстового столбца (аналог clean_text для Series)
     
-    return text
+    Спецсимволы удаляются до схлопывания пробелов, поэтому достаточно двух проходов:
+    пробелы, оставшиеся рядом после удаления, схлопываются тем же проходом.
+    Строки обрабатываются UTF-8 ядрами pyarrow.compute; столбцы, загруженные как
+    string[pyarrow], не копируются.
+    
+    Args:
+        texts: Series с исходными текстами
+        
+    Returns:
+        Series string[pyarrow] с очищенными текстами; пропуски заменяются пустой строкой
+    """
+    arr = pc.fill_null(_arrow_strings(texts), '')
+    arr = pc.replace_substring_regex(arr, _ARROW_SPECIAL_CHARS_RE, '')
+    arr = pc.replace_substring_regex(arr, _ARROW_WHITESPACE_RE, ' ')
+    arr = pc.utf8_trim(arr, ' ')
+    return pd.Series(pd.arrays.ArrowStringArray(arr), index=texts.index, name=texts.name)
 
 
 def parse_price(price_str: str) -> float:
@@ -102,16 +240,13 @@ def parse_price(price_str: str) -> float:
     Returns:
         цена в виде числа
     """
-    if pd.isna(price_str) or price_str is None:
-        return np.nan
-    
-    price_str = str(price_str)
-    
-    # Удаление символов валюты и пробелов
-    price_str = re.sub(r'[^\d.,]', '', price_str)
+    if not isinstance(price_str, str):
+        if price_str is None or pd.isna(price_str):
+            return np.nan
+        price_str = str(price_str)
     
-    # Замена запятой на точку
-    price_str = price_str.replace(',', '')
+    # Удаление символов валюты, пробелов и разделителей тысяч
+    price_str = _PRICE_JUNK_RE.sub('', price_str)
     
     try:
         return float(price_str)
@@ -119,6 +254,21 @@ def parse_price(price_str: str) -> float:
         return np.nan
 
 
+def parse_price_series(prices: pd.Series) -> pd.Series:
+    """
+    Векторный парсинг цен (аналог parse_price для Series)
+    
+    Args:
+        prices: Series со строками цен
+        
+    Returns:
+        Series цен типа float64; нераспознанные значения -> NaN
+    """
+    encoded = _unique_strings(prices)
+    cleaned = pc.replace_substring_regex(encoded.dictionary, _ARROW_PRICE_JUNK_RE, '')
+    return _take_floats(cleaned, encoded.indices, prices)
+
+
 def parse_square_feet(sqft_str: str) -> float:
     """
     Парсинг площади из строки
@@ -129,13 +279,13 @@ def parse_square_feet(sqft_str: str) -> float:
     Returns:
         площадь в квадратных футах
     """
-    if pd.isna(sqft_str) or sqft_str is None:
-        return np.nan
-    
-    sqft_str = str(sqft_str)
+    if not isinstance(sqft_str, str):
+        if sqft_str is None or pd.isna(sqft_str):
+            return np.nan
+        sqft_str = str(sqft_str)
     
     # Извлечение числа
-    match = re.search(r'([\d,]+)', sqft_str)
+    match = _SQFT_NUMBER_RE.search(sqft_str)
     if match:
         num_str = match.group(1).replace(',', '')
         try:
@@ -146,6 +296,22 @@ def parse_square_feet(sqft_str: str) -> float:
     return np.nan
 
 
+def parse_square_feet_series(sqft: pd.Series) -> pd.Series:
+    """
+    Векторный парсинг площади (аналог parse_square_feet для Series)
+    
+    Args:
+        sqft: Series со строками площади
+        
+    Returns:
+        Series площадей типа float64; нераспознанные значения -> NaN
+    """
+    encoded = _unique_strings(sqft)
+    numbers = pc.struct_field(pc.extract_regex(encoded.dictionary, _ARROW_SQFT_NUMBER_RE), 'number')
+    numbers = pc.replace_substring(numbers, ',', '')
+    return _take_floats(numbers, encoded.indices, sqft)
+
+
 def extract_city_state(location: str) -> tuple:
     """
     Извлечение города и штата из строки локации
@@ -156,21 +322,50 @@ def extract_city_state(location: str) -> tuple:
     Returns:
         кортеж (город, штат)
     """
-    if pd.isna(location) or location is None:
-        return (None, None)
+    if not isinstance(location, str):
+        if location is None or pd.isna(location):
+            return (None, None)
+        location = str(location)
     
-    location = str(location).strip()
+    location = location.strip()
     
-    # Паттерн для извлечения города и штата
-    match = re.search(r'([^,]+),\s*([A-Z]{2})', location)
-    if match:
-        city = match.group(1).strip()
-        state = match.group(2).strip()
-        return (city, state)
+    # Частый случай "Город, ШТ 12345": штат сразу после первой запятой, без разбиения всей строки
+    city, _, tail = location.partition(',')
+    tail = tail.lstrip()
+    if city and 'A' <= tail[:1] <= 'Z' and 'A' <= tail[1:2] <= 'Z':
+        return (city.strip(), tail[:2])
+    
+    # Первый непустой фрагмент, за запятой после которого идут две заглавные латинские буквы
+    # (та же семантика, что у поиска по шаблону "город, ШТ", но без регулярного выражения)
+    parts = location.split(',')
+    for city, tail in zip(parts[1:], parts[2:]):
+        tail = tail.lstrip()
+        if city and 'A' <= tail[:1] <= 'Z' and 'A' <= tail[1:2] <= 'Z':
+            return (city.strip(), tail[:2])
     
     return (None, None)
 
 
+def extract_city_state_series(locations: pd.Series) -> pd.DataFrame:
+    """
+    Векторное извлечение города и штата (аналог extract_city_state для Series)
+    
+    Args:
+        locations: Series со строками локации
+        
+    Returns:
+        DataFrame со столбцами city и state (string[pyarrow]); нераспознанные строки -> NA
+    """
+    encoded = _unique_strings(locations)
+    matches = pc.extract_regex(pc.utf8_trim_whitespace(encoded.dictionary), _ARROW_CITY_STATE_RE)
+    city = pc.take(pc.utf8_trim_whitespace(pc.struct_field(matches, 'city')), encoded.indices)
+    state = pc.take(pc.struct_field(matches, 'state'), encoded.indices)
+    return pd.DataFrame({
+        'city': pd.arrays.ArrowStringArray(city),
+        'state': pd.arrays.ArrowStringArray(state)
+    }, index=locations.index)
+
+
 def fips_to_state_abbr(fips_code: Optional[str]) -> Optional[str]:
     """
     Конвертация двухзначного FIPS-кода штата в почтовую аббревиатуру.
@@ -187,7 +382,7 @@ def fips_to_state_abbr(fips_code: Optional[str]) -> Optional[str]:
     if isinstance(fips_code, (int, float)):
         if pd.isna(fips_code):
             return None
-        fips_str = f"{int(fips_code):02d}"
+        return FIPS_INT_TO_STATE.get(int(fips_code))
     else:
         fips_str = str(fips_code).strip()
         if len(fips_str) == 1:
@@ -195,3 +390,71 @@ def fips_to_state_abbr(fips_code: Optional[str]) -> Optional[str]:
 
     return FIPS_TO_STATE.get(fips_str)
 
+
+def fips_to_state_abbr_series(fips_codes: pd.Series) -> pd.Series:
+    """
+    Векторная конвертация FIPS-кодов штатов в почтовые аббревиатуры.
+
+    Args:
+        fips_codes: Series с кодами FIPS (строки или числа)
+
+    Returns:
+        категориальный Series с аббревиатурами; неизвестные коды -> NaN
+    """
+    if pd.api.types.is_integer_dtype(fips_codes.dtype) and not fips_codes.hasnans:
+        # Целочисленный столбец без пропусков индексирует таблицу напрямую, без перевода во float
+        values = fips_codes.to_numpy(dtype=np.int64)
+        valid = (values >= 0) & (values < len(_FIPS_CATEGORY_CODES))
+    else:
+        values = pd.to_numeric(fips_codes, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = (
+            np.isfinite(values)
+            & (values >= 0)
+            & (values < len(_FIPS_CATEGORY_CODES))
+            & (np.floor(values) == values)
+        )
+    codes = np.full(len(values), -1, dtype=np.int8)
+    codes[valid] = _FIPS_CATEGORY_CODES[values[valid].astype(np.intp)]
+
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=STATE_ABBRS),
+        index=fips_codes.index,
+        name=fips_codes.name
+    )
+
+
+def fips_to_state_abbr_bulk(codes: np.ndarray) -> np.ndarray:
+    """
+    Конвертация массива целых FIPS-кодов в аббревиатуры одной выборкой из таблицы.
+
+    Args:
+        codes: NumPy-массив целых кодов FIPS
+
+    Returns:
+        object-массив той же формы с аббревиатурами; неизвестные коды -> None
+    """
+    idx = np.asarray(codes).astype(np.int64, copy=False)
+    valid = (idx >= 0) & (idx < len(_FIPS_TABLE))
+
+    out = np.full(idx.shape, None, dtype=object)
+    out[valid] = _FIPS_TABLE[idx[valid]]
+    return out
+
+
+def fips_to_state_abbr_arrow(codes: pa.Array) -> pa.Array:
+    """
+    Конвертация Arrow-массива FIPS-кодов в аббревиатуры без перехода в pandas.
+
+    Args:
+        codes: Arrow-массив кодов FIPS (целые числа или строки)
+
+    Returns:
+        Arrow-массив строк с аббревиатурами; неизвестные коды -> null
+    """
+    if pa.types.is_integer(codes.type):
+        positions = pc.index_in(pc.cast(codes, pa.int64()), value_set=_ARROW_FIPS_INT_KEYS)
+    else:
+        # Строковые коды дополняются ведущим нулём, как в fips_to_state_abbr
+        padded = pc.utf8_lpad(pc.utf8_trim_whitespace(pc.cast(codes, pa.string())), 2, '0')
+        positions = pc.index_in(padded, value_set=_ARROW_FIPS_KEYS)
+    return pc.take(_ARROW_FIPS_STATES, positions)